@@ -1,44 +1,153 @@
-from flask import Flask, render_template, jsonify
+from flask import Flask, render_template, jsonify, request, Response
 import json
 from pathlib import Path
 import sys
 import os
+import queue
+import threading
+import time
+import uuid
+import copy
+from concurrent.futures import ThreadPoolExecutor
 
 # Add the current directory to Python path to import our analyzer
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from whatif import DSATWhatIfAnalyzer
+from time_stats import QuestionTimeStats, attempt_key
+from scoring_registry import ScoringMapRegistry
+from topic_rollups import TopicRollupStore, COHORT, ORDERINGS
 
 app = Flask(__name__)
 
+TIME_STATS_PATH = Path("Data/time_stats.json")
+
+# One in-memory copy of the cohort time statistics; refreshes swap in an updated copy under the lock
+time_stats = QuestionTimeStats.load(TIME_STATS_PATH)
+time_stats_lock = threading.Lock()
+
+# Shared across requests: every scoring file is loaded once and the right map is picked per student
+scoring_registry = ScoringMapRegistry(Path("Data"))
+_analyzer = None
+analyzer_lock = threading.Lock()
+rollup_store = TopicRollupStore(Path("Data/topic_rollups.sqlite3"))
+rollups_lock = threading.Lock()
+
+def get_analyzer():
+    """Shared analyzer with dynamic thresholds set once on first use. Callers take one reference per
+    request; a published analyzer is never mutated, changes go through replace_analyzer()"""
+    global _analyzer
+    with analyzer_lock:
+        if _analyzer is None:
+            analyzer = DSATWhatIfAnalyzer(scoring_registry, time_stats=time_stats)
+            analyzer.set_dynamic_thresholds(analyzer.collect_threshold_data())
+            _analyzer = analyzer
+        return _analyzer
+
+def replace_analyzer(configure):
+    """Publish a reconfigured copy of the shared analyzer; in-flight requests keep the one they hold"""
+    global _analyzer
+    with analyzer_lock:
+        if _analyzer is None:
+            return None  # get_analyzer() builds it from the current state on first use
+        analyzer = copy.copy(_analyzer)
+        configure(analyzer)
+        _analyzer = analyzer
+        return analyzer
+
 def load_data():
-    """Load student data and scoring maps"""
+    """Load student response data"""
     try:
-        with open(Path("Data/scoring_DSAT_v2.json")) as f:
-            scoring_data = json.load(f)
         with open(Path("Data/stu1.json")) as f:
-            student_responses = json.load(f)
-        return scoring_data, student_responses
+            return json.load(f)
     except Exception as e:
         print(f"Error loading data: {e}")
-        return None, None
+        return None
+
+def refresh_time_stats():
+    """Fold any new cohort responses into the per-question time statistics and persist them"""
+    global time_stats
+    with time_stats_lock:
+        new_attempts = []
+        for path in sorted(Path("Data").glob("stu*.json")):
+            try:
+                with open(path) as f:
+                    student_responses = json.load(f)
+            except Exception as e:
+                print(f"Error loading {path}: {e}")
+                continue
+            if student_responses and attempt_key(student_responses[0]) not in time_stats.ingested_attempts:
+                new_attempts.append(student_responses)
+        if new_attempts:
+            # Update a copy so analyses reading the current statistics are never mutated underneath
+            updated = time_stats.copy()
+            for student_responses in new_attempts:
+                updated.update(student_responses)
+            try:
+                updated.save(TIME_STATS_PATH)
+            except Exception as e:
+                print(f"Error saving time stats: {e}")
+            time_stats = updated
+            replace_analyzer(lambda analyzer: setattr(analyzer, 'time_stats', updated))
+        return time_stats
+
+def load_roster():
+    """Every student attempt in Data/stu*.json"""
+    roster = []
+    for path in sorted(Path("Data").glob("stu*.json")):
+        try:
+            with open(path) as f:
+                student_responses = json.load(f)
+        except Exception as e:
+            print(f"Error loading {path}: {e}")
+            continue
+        if student_responses:
+            roster.append(student_responses)
+    return roster
+
+def rollup_context(analyzer, student_responses):
+    """Thresholds and scoring map that a student's missed-question impacts were computed under"""
+    return json.dumps({
+        'thresholds': {subject: round(float(t), 4) for subject, t in analyzer.adaptive_thresholds.items()},
+        'scoring_map': analyzer.resolve_scoring_key(student_responses)
+    }, sort_keys=True)
+
+def refresh_topic_rollups(analyzer=None, rebuild=False):
+    """Ingest roster attempts that are not in the rollup store yet. The rollups are additive, so if any
+    stored attempt was ingested under different thresholds or scoring map, everything is rebuilt."""
+    analyzer = analyzer or get_analyzer()
+    with rollups_lock:
+        pending = []
+        for student_responses in load_roster():
+            context = rollup_context(analyzer, student_responses)
+            stored = rollup_store.attempt_context(attempt_key(student_responses[0]))
+            if stored is not None and stored != context:
+                rebuild = True
+            pending.append((student_responses, context, stored is None))
+        if rebuild:
+            ingested = rollup_store.rebuild([
+                (student_responses, analyzer.calculate_missed_impacts(student_responses), context)
+                for student_responses, context, _ in pending
+            ])
+        else:
+            ingested = sum(
+                1 for student_responses, context, is_new in pending
+                if is_new and rollup_store.ingest(
+                    student_responses, analyzer.calculate_missed_impacts(student_responses), context)
+            )
+        return {'rebuilt': rebuild, 'ingested': ingested}
 
-def analyze_student_data():
+def analyze_student_data(rank_by='impact'):
     """Run the SAT analysis and return structured results"""
-    scoring_data, student_responses = load_data()
+    student_responses = load_data()
     
-    if not scoring_data or not student_responses:
+    if not student_responses or not scoring_registry.sources:
         return None
     
-    # Initialize analyzer
-    analyzer = DSATWhatIfAnalyzer(scoring_data)
-    
-    # Set dynamic thresholds
-    historical_data = analyzer.collect_threshold_data()
-    analyzer.set_dynamic_thresholds(historical_data)
+    analyzer = get_analyzer()
     
     # Generate recommendations
-    results = analyzer.generate_recommendations(student_responses)
+    results = analyzer.generate_recommendations(student_responses, rank_by=rank_by)
     
     # Calculate subject-specific scores for visualization
     subject_scores = {}
@@ -87,9 +196,147 @@ def analyze_student_data():
         'total_current': total_current,
         'total_potential': total_potential,
         'total_gain': total_potential - total_current,
-        'thresholds': analyzer.adaptive_thresholds
+        'thresholds': analyzer.adaptive_thresholds,
+        'scoring_map': results['scoring_map'],
+        'student_id': student_responses[0].get('student_id'),
+        'rank_by': rank_by
     }
 
+# === COHORT ANALYSIS JOBS ===
+job_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cohort-job')
+jobs = {}
+jobs_lock = threading.Lock()
+MAX_FINISHED_JOBS = 20
+SUBSCRIBER_QUEUE_SIZE = 16  # Slow SSE clients drop the oldest progress events beyond this
+SSE_HEARTBEAT_SECONDS = 15
+TERMINAL_STATUSES = ('completed', 'cancelled', 'failed')
+
+class AnalysisJob:
+    """A background cohort analysis whose progress is fanned out to SSE subscribers"""
+
+    def __init__(self, batch_size: int):
+        self.job_id = uuid.uuid4().hex
+        self.batch_size = batch_size
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.cancel_event = threading.Event()
+        self.last_event = {'status': self.status}
+        self.subscribers = []
+        self.lock = threading.Lock()
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.last_event, job_id=self.job_id, status=self.status)
+
+    def publish(self, event_type, data):
+        """Send an event to every subscriber; a full queue drops its oldest event (latest progress wins)"""
+        with self.lock:
+            self.last_event = data
+            message = (event_type, dict(data, job_id=self.job_id, status=self.status))
+            for subscriber in self.subscribers:
+                while True:
+                    try:
+                        subscriber.put_nowait(message)
+                        break
+                    except queue.Full:
+                        try:
+                            subscriber.get_nowait()
+                        except queue.Empty:
+                            pass
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self.lock:
+            # Late subscribers start from the latest state
+            event_type = self.status if self.status in TERMINAL_STATUSES else 'progress'
+            subscriber.put_nowait((event_type, dict(self.last_event, job_id=self.job_id, status=self.status)))
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+def run_cohort_analysis(job: AnalysisJob):
+    """Re-tune thresholds and re-score the roster batch by batch, publishing progress after each batch.
+    A completed job applies the tuned thresholds to the shared analyzer and brings the topic rollups in line."""
+    started = time.time()
+    if job.cancel_event.is_set():
+        # Cancelled while queued: do no work at all
+        job.status = 'cancelled'
+        job.publish('cancelled', dict(job.last_event, elapsed_seconds=0))
+        return
+    job.status = 'running'
+    try:
+        roster = load_roster()
+        # Impact ranking only; the job never reads the time statistics
+        analyzer = DSATWhatIfAnalyzer(scoring_registry)
+        analyzer.set_dynamic_thresholds(analyzer.collect_threshold_data())
+        job.publish('progress', {'processed': 0, 'total': len(roster), 'thresholds': analyzer.adaptive_thresholds})
+
+        aggregates = {
+            'students_scored': 0,
+            'total_current_score': 0,
+            'total_potential_gain': 0,
+            'hard_module2': {subject: 0 for subject in analyzer.subjects}
+        }
+        for start in range(0, len(roster), job.batch_size):
+            if job.cancel_event.is_set():
+                break
+            for student_responses in roster[start:start + job.batch_size]:
+                results = analyzer.generate_recommendations(student_responses)
+                aggregates['students_scored'] += 1
+                aggregates['total_current_score'] += results['current_total_score']
+                aggregates['total_potential_gain'] += sum(
+                    recs['total_potential_gain'] for recs in results['recommendations'].values())
+                for subject, difficulty in results['current_module2_difficulties'].items():
+                    if difficulty == 'hard':
+                        aggregates['hard_module2'][subject] += 1
+
+            elapsed = time.time() - started
+            scored = aggregates['students_scored']
+            job.publish('progress', {
+                'processed': scored,
+                'total': len(roster),
+                'batch': start // job.batch_size + 1,
+                'elapsed_seconds': round(elapsed, 2),
+                'students_per_second': round(scored / elapsed, 2) if elapsed > 0 else None,
+                'thresholds': analyzer.adaptive_thresholds,
+                'partial': {
+                    'average_current_score': aggregates['total_current_score'] / scored,
+                    'average_potential_gain': aggregates['total_potential_gain'] / scored,
+                    'hard_module2': dict(aggregates['hard_module2'])
+                }
+            })
+
+        if job.cancel_event.is_set():
+            job.status = 'cancelled'
+            job.publish('cancelled', dict(job.last_event, elapsed_seconds=round(time.time() - started, 2)))
+            return
+
+        def apply_thresholds(shared):
+            shared.adaptive_thresholds = dict(analyzer.adaptive_thresholds)
+            shared.threshold_validation_data = dict(analyzer.threshold_validation_data)
+
+        get_analyzer()  # Make sure there is a shared analyzer to reconfigure
+        tuned = replace_analyzer(apply_thresholds)
+        # Rebuilds the rollups if the new thresholds change any attempt's impacts
+        rollups = refresh_topic_rollups(tuned)
+        job.status = 'completed'
+        job.publish('completed', dict(job.last_event, rollups=rollups,
+                                      elapsed_seconds=round(time.time() - started, 2)))
+    except Exception as e:
+        print(f"Cohort analysis job {job.job_id} failed: {e}")
+        job.status = 'failed'
+        job.publish('failed', dict(job.last_event, error=str(e)))
+
+def prune_jobs():
+    """Forget the oldest finished jobs beyond MAX_FINISHED_JOBS"""
+    finished = sorted((j for j in jobs.values() if j.status in TERMINAL_STATUSES), key=lambda j: j.created_at)
+    for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+        del jobs[job.job_id]
+
 @app.route('/')
 def index():
     """Main dashboard page"""
@@ -97,17 +344,64 @@ def index():
 
 @app.route('/api/analysis')
 def get_analysis():
-    """API endpoint to get analysis data"""
-    data = analyze_student_data()
+    """API endpoint to get analysis data (?rank_by=efficiency orders by points per minute)"""
+    rank_by = request.args.get('rank_by', 'impact')
+    if rank_by not in ('impact', 'efficiency'):
+        return jsonify({'error': f'Unknown rank_by: {rank_by}'}), 400
+    data = analyze_student_data(rank_by)
     if data:
         return jsonify(data)
     else:
         return jsonify({'error': 'Failed to load data'}), 500
 
+@app.route('/api/topics/weakest')
+def get_weakest_topics():
+    """Weakest topics for a student (or the cohort) read from the pre-aggregated rollups"""
+    order_by = request.args.get('order_by', 'missed_impact')
+    if order_by not in ORDERINGS:
+        return jsonify({'error': f'Unknown order_by: {order_by}'}), 400
+    topics = rollup_store.weakest_topics(
+        student_id=request.args.get('student_id', COHORT),
+        limit=request.args.get('limit', 5, type=int),
+        order_by=order_by,
+        subject=request.args.get('subject')
+    )
+    return jsonify({'topics': topics, 'order_by': order_by})
+
+@app.route('/api/time-stats/ingest', methods=['POST'])
+def ingest_time_stats():
+    """Fold new attempts from Data/stu*.json into the per-question time statistics"""
+    stats = refresh_time_stats()
+    return jsonify({'attempts': len(stats.ingested_attempts), 'questions': len(stats.sketches),
+                    'last_updated': stats.last_updated})
+
+@app.route('/api/topics/ingest', methods=['POST'])
+def ingest_topic_rollups():
+    """Ingest new attempts into the topic rollups (?rebuild=1 recomputes every attempt)"""
+    rebuild = request.args.get('rebuild', '0').lower() in ('1', 'true', 'yes')
+    return jsonify(refresh_topic_rollups(rebuild=rebuild))
+
+@app.route('/api/topics/rollup')
+def get_topic_rollup():
+    """Subject → unit → topic rollup: subjects, units of ?subject=, or topics of ?subject=&unit="""
+    order_by = request.args.get('order_by', 'missed_impact')
+    if order_by not in ORDERINGS:
+        return jsonify({'error': f'Unknown order_by: {order_by}'}), 400
+    rows = rollup_store.rollup(
+        student_id=request.args.get('student_id', COHORT),
+        subject=request.args.get('subject'),
+        unit=request.args.get('unit'),
+        order_by=order_by
+    )
+    return jsonify({'rollup': rows, 'order_by': order_by})
+
 @app.route('/api/score-progression/<subject>')
 def get_score_progression(subject):
     """Get score progression data for a specific subject"""
-    data = analyze_student_data()
+    rank_by = request.args.get('rank_by', 'impact')
+    if rank_by not in ('impact', 'efficiency'):
+        return jsonify({'error': f'Unknown rank_by: {rank_by}'}), 400
+    data = analyze_student_data(rank_by)
     if not data or subject not in data['subject_scores']:
         return jsonify({'error': 'Subject not found'}), 404
     
@@ -127,5 +421,69 @@ def get_score_progression(subject):
         'questions': subject_data['top_questions']
     })
 
+@app.route('/api/jobs', methods=['POST'])
+def start_job():
+    """Start a cohort analysis in the background; progress is at /api/jobs/<job_id>/events"""
+    batch_size = (request.get_json(silent=True) or {}).get('batch_size', 25)
+    if not isinstance(batch_size, int) or isinstance(batch_size, bool) or batch_size < 1:
+        return jsonify({'error': 'batch_size must be a positive integer'}), 400
+    job = AnalysisJob(batch_size)
+    with jobs_lock:
+        prune_jobs()
+        jobs[job.job_id] = job
+    job_executor.submit(run_cohort_analysis, job)
+    return jsonify(job.snapshot()), 202
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    """Latest progress snapshot for a job"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.snapshot())
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Ask a job to stop after its current batch"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    job.cancel_event.set()
+    return jsonify(job.snapshot()), 202
+
+@app.route('/api/jobs/<job_id>/events')
+def stream_job_events(job_id):
+    """Server-Sent Events stream of a job's progress, ending with its terminal event"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    def generate():
+        subscriber = job.subscribe()
+        try:
+            while True:
+                try:
+                    event_type, data = subscriber.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": heartbeat\n\n"  # Keeps proxies from closing an idle stream
+                    continue
+                yield f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+                if data['status'] in TERMINAL_STATUSES:
+                    break
+        finally:
+            job.unsubscribe(subscriber)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def init_data():
+    """Startup ingestion of Data/stu*.json. Requests only read the results; later attempts come in via
+    /api/time-stats/ingest, /api/topics/ingest or cohort analysis jobs"""
+    refresh_time_stats()
+    refresh_topic_rollups()
+
 if __name__ == '__main__':
+    # debug=True runs this script in a reloader watcher and a serving child; only the child ingests
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        init_data()
     app.run(debug=True, host='0.0.0.0', port=5000)
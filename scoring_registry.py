@@ -0,0 +1,130 @@
+import json
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Tuple, Optional
+from pathlib import Path
+
+SCORING_FILE_PATTERN = re.compile(r'^scoring_(?P<program>[A-Za-z0-9]+)_(?P<version>v\d+)\.json$')
+
+
+class ScoringMapRegistry:
+    """Registry of scoring maps keyed by (program, version, subject).
+
+    Every scoring_<PROGRAM>_<version>.json file in the directory is loaded up front; each map is
+    compiled to raw-score lookup tables on first use and the least recently used tables are evicted.
+    An optional scoring_index.json maps parentTest/practicesetId values to a program and version.
+    """
+
+    def __init__(self, directory: Path = Path("Data"), max_compiled: int = 8, default_program: str = 'DSAT'):
+        self.directory = Path(directory)
+        self.max_compiled = max_compiled
+        self.default_program = default_program
+        self.sources: Dict[Tuple[str, str, str], List[Dict]] = {}
+        self.test_index: Dict[str, Tuple[str, str]] = {}
+        self._compiled = OrderedDict()
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """(Re)load every scoring file and the test index from the directory"""
+        sources = {}
+        for path in sorted(self.directory.glob("scoring_*.json")):
+            match = SCORING_FILE_PATTERN.match(path.name)
+            if not match:
+                continue
+            with open(path) as f:
+                scoring_data = json.load(f)
+            for scoring_item in scoring_data:
+                program = scoring_item.get('program', match.group('program'))
+                sources[(program, match.group('version'), scoring_item['key'])] = scoring_item['map']
+
+        # A fresh index each load, so entries removed from the file stop routing
+        test_index = {}
+        index_path = self.directory / "scoring_index.json"
+        if index_path.exists():
+            with open(index_path) as f:
+                for test_id, entry in json.load(f).get('tests', {}).items():
+                    key = (entry['program'], entry['version'])
+                    if not self._is_loaded(sources, key):
+                        print(f"Warning: scoring_index.json routes {test_id} to {key[0]} {key[1]}, "
+                              f"which has no scoring file; using the default map instead")
+                        continue
+                    test_index[test_id] = key
+
+        with self._lock:
+            self.sources = sources
+            self.test_index = test_index
+            self._compiled.clear()
+
+    def register_test(self, test_id: str, program: str, version: str):
+        """Route responses from a parentTest or practicesetId to a specific scoring map"""
+        with self._lock:
+            if not self._is_loaded(self.sources, (program, version)):
+                raise ValueError(f"No scoring map loaded for {program} {version}")
+            self.test_index[test_id] = (program, version)
+
+    @staticmethod
+    def _is_loaded(sources: Dict, key: Tuple[str, str]) -> bool:
+        return any((program, version) == key for (program, version, _) in sources)
+
+    def versions(self, program: str) -> List[str]:
+        """Known versions for a program, oldest first"""
+        found = {version for (prog, version, _) in self.sources if prog == program}
+        return sorted(found, key=lambda v: int(v[1:]))
+
+    def default_key(self) -> Optional[Tuple[str, str]]:
+        """Latest version of the default program"""
+        versions = self.versions(self.default_program)
+        return (self.default_program, versions[-1]) if versions else None
+
+    def resolve(self, student_responses: List[Dict]) -> Optional[Tuple[str, str]]:
+        """Pick the (program, version) for a student's responses from parentTest, then practicesetId"""
+        for response in student_responses:
+            for field in ('parentTest', 'practicesetId'):
+                test_id = response.get(field)
+                if test_id in self.test_index:
+                    return self.test_index[test_id]
+        return self.default_key()
+
+    def _compile(self, score_map: List[Dict]) -> Dict[str, List[int]]:
+        """Compile a list of {'raw', 'hard', 'easy'} rows into per-difficulty lists indexed by raw score"""
+        size = max(mapping['raw'] for mapping in score_map) + 1
+        tables = {}
+        for mapping in score_map:
+            for difficulty_level, scaled in mapping.items():
+                if difficulty_level == 'raw':
+                    continue
+                table = tables.setdefault(difficulty_level, [200] * size)
+                table[mapping['raw']] = scaled
+        return tables
+
+    def get_table(self, program: str, version: str, subject: str) -> Optional[Dict[str, List[int]]]:
+        """Compiled lookup tables for a map, compiling and evicting (LRU) as needed"""
+        key = (program, version, subject)
+        with self._lock:
+            if key in self._compiled:
+                self._compiled.move_to_end(key)
+                return self._compiled[key]
+            score_map = self.sources.get(key)
+            if not score_map:
+                return None
+            tables = self._compile(score_map)
+            self._compiled[key] = tables
+            while len(self._compiled) > self.max_compiled:
+                self._compiled.popitem(last=False)
+            return tables
+
+    def get_scaled_score(self, scoring_key: Optional[Tuple[str, str]], subject: str,
+                         raw_score: int, difficulty_level: str) -> int:
+        if scoring_key is None:
+            return 200  # No scoring map available
+        tables = self.get_table(scoring_key[0], scoring_key[1], subject)
+        if tables is None:
+            return 200  # Default score if subject not found
+        table = tables[difficulty_level]
+        if raw_score < 0:
+            return 200
+        elif raw_score >= len(table):
+            return table[-1]
+        return table[raw_score]
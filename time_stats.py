@@ -0,0 +1,224 @@
+import json
+import math
+import os
+import tempfile
+from typing import List, Dict, Optional
+from pathlib import Path
+from datetime import datetime
+
+
+def attempt_key(response: Dict) -> str:
+    """Identifies one student's attempt at a test; all responses of an attempt share it"""
+    return f"{response.get('_id', '')}:{response.get('student_id', '')}"
+
+
+class QuantileSketch:
+    """Mergeable log-bucketed quantile sketch (DDSketch style) for response timings"""
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value: float):
+        """Add a single timing to the sketch"""
+        if value is None or value < 0:
+            return
+        if value == 0:
+            self.zero_count += 1
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: 'QuantileSketch'):
+        """Fold another sketch (e.g. from a different batch shard) into this one"""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        for index, bucket_count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + bucket_count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        if other.max is not None:
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Approximate q-quantile (0 <= q <= 1), within relative_accuracy of the true value"""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # Bucket midpoint keeps the estimate within the relative error bound
+                estimate = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    def to_dict(self) -> Dict:
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'buckets': {str(k): v for k, v in self.buckets.items()},
+            'zero_count': self.zero_count,
+            'count': self.count,
+            'total': self.total,
+            'min': self.min,
+            'max': self.max
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'QuantileSketch':
+        sketch = cls(data.get('relative_accuracy', 0.01))
+        sketch.buckets = {int(k): v for k, v in data.get('buckets', {}).items()}
+        sketch.zero_count = data.get('zero_count', 0)
+        sketch.count = data.get('count', 0)
+        sketch.total = data.get('total', 0.0)
+        sketch.min = data.get('min')
+        sketch.max = data.get('max')
+        return sketch
+
+
+class QuestionTimeStats:
+    """Per-question time_spent statistics aggregated across the cohort in a single streaming pass.
+
+    Every timing goes into `sketches`; timings of correct responses also go into `correct_sketches`,
+    which measure time to solve a question and so exclude rushed guesses.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self.sketches: Dict[str, QuantileSketch] = {}
+        self.correct_sketches: Dict[str, QuantileSketch] = {}
+        self.ingested_attempts = set()  # (attempt _id, student_id) pairs already counted
+        self.last_updated = None
+
+    def update(self, responses: List[Dict]) -> int:
+        """Stream responses into the sketches, skipping attempts that were already ingested.
+        Returns the number of timings added."""
+        added = 0
+        new_attempts = set()
+        for response in responses:
+            attempt = attempt_key(response)
+            if attempt in self.ingested_attempts:
+                continue
+            new_attempts.add(attempt)
+            time_spent = response.get('time_spent')
+            if time_spent is None:
+                continue
+            self._sketch(self.sketches, response['question_id']).add(time_spent)
+            if response.get('correct'):
+                self._sketch(self.correct_sketches, response['question_id']).add(time_spent)
+            added += 1
+        self.ingested_attempts |= new_attempts
+        if added:
+            self.last_updated = datetime.now().isoformat()
+        return added
+
+    def _sketch(self, sketches: Dict[str, QuantileSketch], question_id: str) -> QuantileSketch:
+        sketch = sketches.get(question_id)
+        if sketch is None:
+            sketch = sketches[question_id] = QuantileSketch(self.relative_accuracy)
+        return sketch
+
+    def merge(self, other: 'QuestionTimeStats'):
+        """Combine statistics computed on a different batch shard. Shards must cover disjoint attempts,
+        otherwise the same timings would be counted twice."""
+        overlap = self.ingested_attempts & other.ingested_attempts
+        if overlap:
+            raise ValueError(f"Cannot merge shards that both ingested {len(overlap)} attempt(s): {sorted(overlap)[:3]}")
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge statistics with different relative accuracy")
+        for mine, theirs in ((self.sketches, other.sketches), (self.correct_sketches, other.correct_sketches)):
+            for question_id, sketch in theirs.items():
+                self._sketch(mine, question_id).merge(sketch)
+        self.ingested_attempts |= other.ingested_attempts
+        self.last_updated = datetime.now().isoformat()
+
+    def summary(self, question_id: str) -> Optional[Dict]:
+        """Count, mean, median and p90 time_spent (ms) for a question"""
+        sketch = self.sketches.get(question_id)
+        if sketch is None or sketch.count == 0:
+            return None
+        return {
+            'count': sketch.count,
+            'mean': sketch.mean(),
+            'p50': sketch.quantile(0.5),
+            'p90': sketch.quantile(0.9)
+        }
+
+    def expected_minutes(self, question_id: str, quantile: float = 0.5) -> Optional[float]:
+        """Cohort time-to-solve quantile for a question in minutes, from correct responses when there
+        are any, else from all responses"""
+        for sketches in (self.correct_sketches, self.sketches):
+            sketch = sketches.get(question_id)
+            if sketch is not None and sketch.count > 0:
+                return sketch.quantile(quantile) / 60000
+        return None
+
+    def to_dict(self) -> Dict:
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'last_updated': self.last_updated,
+            'ingested_attempts': sorted(self.ingested_attempts),
+            'questions': {qid: sketch.to_dict() for qid, sketch in self.sketches.items()},
+            'correct_questions': {qid: sketch.to_dict() for qid, sketch in self.correct_sketches.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'QuestionTimeStats':
+        if data.get('questions') and 'correct_questions' not in data:
+            # Written before correct timings were tracked; the attempts have to be ingested again
+            raise ValueError("statistics have no correct-response timings")
+        stats = cls(data.get('relative_accuracy', 0.01))
+        stats.last_updated = data.get('last_updated')
+        stats.ingested_attempts = set(data.get('ingested_attempts', []))
+        stats.sketches = {qid: QuantileSketch.from_dict(s) for qid, s in data.get('questions', {}).items()}
+        stats.correct_sketches = {qid: QuantileSketch.from_dict(s)
+                                  for qid, s in data.get('correct_questions', {}).items()}
+        return stats
+
+    def copy(self) -> 'QuestionTimeStats':
+        return QuestionTimeStats.from_dict(self.to_dict())
+
+    def save(self, path: Path):
+        """Write to a temp file in the same directory and swap it into place, so readers never see a partial file"""
+        path = Path(path)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.to_dict(), f)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path: Path) -> 'QuestionTimeStats':
+        """Load persisted statistics, or start empty if the file does not exist yet or is unreadable"""
+        path = Path(path)
+        if not path.exists():
+            return cls()
+        try:
+            with open(path) as f:
+                return cls.from_dict(json.load(f))
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            print(f"Warning: could not read time stats from {path}, starting empty: {e}")
+            return cls()
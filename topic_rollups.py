@@ -0,0 +1,181 @@
+import sqlite3
+from typing import List, Dict, Optional, Tuple
+from pathlib import Path
+from datetime import datetime
+from time_stats import attempt_key
+
+COHORT = '*'  # student_id used for cohort-wide rollups
+ORDERINGS = {
+    'missed_impact': 'missed_impact DESC',
+    'accuracy': 'accuracy ASC',
+    'time_spent': 'time_spent DESC'
+}
+
+
+def _name(value, default: str = 'Unknown') -> str:
+    """Names come as {'_id', 'name'} objects in the response data, or occasionally plain strings"""
+    if isinstance(value, dict):
+        return value.get('name') or default
+    return value or default
+
+
+class TopicRollupStore:
+    """Incrementally maintained subject → unit → topic rollups in a local SQLite store.
+
+    Each row aggregates attempted/correct counts, time spent (ms) and the summed what-if impact of
+    missed questions for one student (or the cohort, student_id='*'). Unit-level rows use topic='' and
+    subject-level rows use unit='' and topic='', so every query is a single indexed read.
+
+    Each ingested attempt records the context its impacts were computed under (thresholds and scoring
+    map); when that context changes the impacts are stale and the store should be rebuilt.
+    """
+
+    def __init__(self, path: Path = Path("Data/topic_rollups.sqlite3")):
+        self.path = Path(path)
+        self._schema_ready = False  # The database file is only created on first use
+
+    def _create_schema(self, conn: sqlite3.Connection):
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS rollups (
+                student_id TEXT NOT NULL,
+                subject TEXT NOT NULL,
+                unit TEXT NOT NULL,
+                topic TEXT NOT NULL,
+                attempted INTEGER NOT NULL DEFAULT 0,
+                correct INTEGER NOT NULL DEFAULT 0,
+                time_spent INTEGER NOT NULL DEFAULT 0,
+                missed_impact REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (student_id, subject, unit, topic)
+            );
+            CREATE TABLE IF NOT EXISTS ingested_attempts (
+                attempt_key TEXT PRIMARY KEY,
+                ingested_at TEXT NOT NULL,
+                context TEXT NOT NULL DEFAULT ''
+            );
+        """)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(ingested_attempts)")]
+        if 'context' not in columns:
+            # Stores created before contexts were recorded; '' never matches a real context
+            conn.execute("ALTER TABLE ingested_attempts ADD COLUMN context TEXT NOT NULL DEFAULT ''")
+            conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection per call keeps the store safe to use from Flask's request threads
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._schema_ready:
+            self._create_schema(conn)
+            self._schema_ready = True
+        return conn
+
+    def attempt_context(self, key: str) -> Optional[str]:
+        """Context an attempt was ingested under, or None if it has not been ingested"""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT context FROM ingested_attempts WHERE attempt_key = ?", (key,)).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+    def ingest(self, student_responses: List[Dict], missed_impacts: Dict[str, float], context: str = '') -> bool:
+        """Add one attempt's responses to the rollups. missed_impacts maps question_id to the
+        what-if impact of answering it correctly. Returns False if the attempt was already ingested."""
+        if not student_responses:
+            return False
+        conn = self._connect()
+        try:
+            with conn:
+                return self._apply(conn, student_responses, missed_impacts, context)
+        finally:
+            conn.close()
+
+    def rebuild(self, attempts: List[Tuple[List[Dict], Dict[str, float], str]]) -> int:
+        """Replace all rollups with the given (responses, missed_impacts, context) attempts in one
+        transaction, so queries never see a half-rebuilt store. Returns the number of attempts ingested."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM rollups")
+                conn.execute("DELETE FROM ingested_attempts")
+                return sum(1 for student_responses, missed_impacts, context in attempts
+                           if student_responses and self._apply(conn, student_responses, missed_impacts, context))
+        finally:
+            conn.close()
+
+    def _apply(self, conn: sqlite3.Connection, student_responses: List[Dict],
+               missed_impacts: Dict[str, float], context: str) -> bool:
+        attempt = attempt_key(student_responses[0])
+
+        # Aggregate deltas in memory first: 3 levels x (student, cohort) per response
+        deltas = {}
+        for response in student_responses:
+            subject = _name(response.get('subject'))
+            unit = _name(response.get('unit'))
+            topic = _name(response.get('topic'))
+            correct = 1 if response.get('correct') else 0
+            time_spent = response.get('time_spent') or 0
+            impact = 0 if correct else missed_impacts.get(response['question_id'], 0)
+            for student_id in (response.get('student_id', ''), COHORT):
+                for key in ((student_id, subject, '', ''), (student_id, subject, unit, ''),
+                            (student_id, subject, unit, topic)):
+                    row = deltas.setdefault(key, [0, 0, 0, 0.0])
+                    row[0] += 1
+                    row[1] += correct
+                    row[2] += time_spent
+                    row[3] += impact
+
+        inserted = conn.execute(
+            "INSERT OR IGNORE INTO ingested_attempts (attempt_key, ingested_at, context) VALUES (?, ?, ?)",
+            (attempt, datetime.now().isoformat(), context)
+        ).rowcount
+        if not inserted:
+            return False
+        conn.executemany("""
+            INSERT INTO rollups (student_id, subject, unit, topic, attempted, correct, time_spent, missed_impact)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (student_id, subject, unit, topic) DO UPDATE SET
+                attempted = attempted + excluded.attempted,
+                correct = correct + excluded.correct,
+                time_spent = time_spent + excluded.time_spent,
+                missed_impact = missed_impact + excluded.missed_impact
+        """, [key + tuple(values) for key, values in deltas.items()])
+        return True
+
+    def _query(self, where: str, params: tuple, order_by: str, limit: Optional[int]) -> List[Dict]:
+        if order_by not in ORDERINGS:
+            raise ValueError(f"Unknown order_by: {order_by}")
+        sql = f"""
+            SELECT subject, unit, topic, attempted, correct, time_spent, missed_impact,
+                   CAST(correct AS REAL) / attempted AS accuracy
+            FROM rollups WHERE {where}
+            ORDER BY {ORDERINGS[order_by]}, subject, unit, topic
+        """
+        if limit is not None:
+            sql += " LIMIT ?"
+            params = params + (limit,)
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            return [dict(row) for row in conn.execute(sql, params)]
+        finally:
+            conn.close()
+
+    def rollup(self, student_id: str = COHORT, subject: Optional[str] = None,
+               unit: Optional[str] = None, order_by: str = 'missed_impact') -> List[Dict]:
+        """Children of a level: subjects, units of a subject, or topics of a unit"""
+        if subject is None:
+            return self._query("student_id = ? AND unit = '' AND topic = ''", (student_id,), order_by, None)
+        if unit is None:
+            return self._query("student_id = ? AND subject = ? AND unit != '' AND topic = ''",
+                               (student_id, subject), order_by, None)
+        return self._query("student_id = ? AND subject = ? AND unit = ? AND topic != ''",
+                           (student_id, subject, unit), order_by, None)
+
+    def weakest_topics(self, student_id: str = COHORT, limit: int = 5,
+                       order_by: str = 'missed_impact', subject: Optional[str] = None) -> List[Dict]:
+        """Topics ranked weakest first (by total what-if impact of missed questions by default)"""
+        where = "student_id = ? AND topic != ''"
+        params = (student_id,)
+        if subject is not None:
+            where += " AND subject = ?"
+            params += (subject,)
+        return self._query(where, params, order_by, limit)
@@ -2,15 +2,29 @@ import json
 from typing import List, Dict, Tuple, Optional
 import numpy as np
 from datetime import datetime, timedelta
+from time_stats import QuestionTimeStats
+from scoring_registry import ScoringMapRegistry
 
 class DSATWhatIfAnalyzer:
-    def __init__(self, scoring_maps: Dict):
+    def __init__(self, scoring_maps: Dict, time_stats: Optional[QuestionTimeStats] = None):
         self.scoring_maps = scoring_maps
+        # A registry picks the scoring map per student; a plain list is used for every student
+        self.scoring_registry = scoring_maps if isinstance(scoring_maps, ScoringMapRegistry) else None
+        self.time_stats = time_stats  # Cohort time_spent statistics for efficiency ranking
         self.subjects = ['Math', 'Reading and Writing']
         self.adaptive_thresholds = {sub: 0.5 for sub in self.subjects}  # Default threshold
         self.threshold_validation_data = {}  # Store validation metrics
 
-    def get_scaled_score(self, subject: str, raw_score: int, difficulty_level: str) -> int:
+    def resolve_scoring_key(self, student_responses: List[Dict]) -> Optional[Tuple[str, str]]:
+        """(program, version) of the scoring map for these responses, or None for a single scoring_maps list"""
+        if self.scoring_registry is None:
+            return None
+        return self.scoring_registry.resolve(student_responses)
+
+    def get_scaled_score(self, subject: str, raw_score: int, difficulty_level: str,
+                         scoring_key: Optional[Tuple[str, str]] = None) -> int:
+        if self.scoring_registry is not None:
+            return self.scoring_registry.get_scaled_score(scoring_key, subject, raw_score, difficulty_level)
         # Find the subject in the scoring data (it's a list, not a dict)
         subject_scoring = None
         for scoring_item in self.scoring_maps:
@@ -53,6 +67,7 @@ class DSATWhatIfAnalyzer:
 
         total_score = 0
         module2_difficulties = {}
+        scoring_key = self.resolve_scoring_key(student_responses)
 
         for subject in self.subjects:
             module1_correct = sum(1 for r in subject_data[subject]['module1'] if r['correct'])
@@ -61,7 +76,7 @@ class DSATWhatIfAnalyzer:
             module2_difficulty = self.determine_module2_difficulty(subject, module1_performance)
             module2_difficulties[subject] = module2_difficulty
             raw_score = subject_data[subject]['total_correct']
-            scaled_score = self.get_scaled_score(subject, raw_score, module2_difficulty)
+            scaled_score = self.get_scaled_score(subject, raw_score, module2_difficulty, scoring_key)
             total_score += scaled_score
 
         return total_score, module2_difficulties
@@ -107,7 +122,8 @@ class DSATWhatIfAnalyzer:
             self.adaptive_thresholds[subject] = self.find_optimal_threshold(data, subject)
 
     def calculate_impact_score(self, student_responses: List[Dict], question_to_change: str,
-                               current_total_score: int, current_module2_difficulties: Dict) -> float:
+                               current_total_score: int, current_module2_difficulties: Dict,
+                               include_complexity_bonus: bool = True) -> float:
         modified_responses = []
         target_question = None
         for response in student_responses:
@@ -130,17 +146,33 @@ class DSATWhatIfAnalyzer:
                 module == 1):
             adaptive_penalty_change = 120  # Increased from 60 to highlight bigger adaptive impact
         
-        # Add complexity-based efficiency bonus (easier questions are more efficient)
-        complexity = target_question.get('compleixty', 'medium').lower()  # Handle the typo in data
-        complexity_bonus = 0
+        if not include_complexity_bonus:
+            return direct_impact + adaptive_penalty_change
+        
+        return direct_impact + adaptive_penalty_change + self.complexity_bonus(target_question)
+
+    def complexity_bonus(self, question: Dict) -> int:
+        """Complexity-based efficiency bonus (easier questions are more efficient)"""
+        complexity = question.get('compleixty', 'medium').lower()  # Handle the typo in data
         if complexity == 'easy':
-            complexity_bonus = 5  # Highest bonus for easy questions
+            return 5  # Highest bonus for easy questions
         elif complexity == 'medium':
-            complexity_bonus = 2  # Medium bonus for medium questions
-        elif complexity == 'hard':
-            complexity_bonus = 0  # No bonus for hard questions (lowest priority)
-        
-        return direct_impact + adaptive_penalty_change + complexity_bonus
+            return 2  # Medium bonus for medium questions
+        return 0  # No bonus for hard questions (lowest priority)
+
+    def calculate_missed_impacts(self, student_responses: List[Dict]) -> Dict[str, float]:
+        """Score points gained (without the complexity bonus) from fixing each missed question"""
+        current_score, current_module2_difficulties = self.calculate_current_score(student_responses)
+        return {
+            r['question_id']: self.calculate_impact_score(
+                student_responses,
+                r['question_id'],
+                current_score,
+                current_module2_difficulties,
+                include_complexity_bonus=False
+            )
+            for r in student_responses if not r['correct']
+        }
 
     def collect_threshold_data(self, connection=None) -> List[Dict]:
         """Collect threshold training data from database or file"""
@@ -170,43 +202,72 @@ class DSATWhatIfAnalyzer:
             {"student_id": "r10", "subject": "Reading and Writing", "module1_correct": 17, "module1_total": 22, "module2_difficulty_received": "hard"},
         ]
 
-    def identify_high_impact_questions(self, student_responses: List[Dict], top_n: int = 5) -> Dict[str, List[Dict]]:
+    def estimate_minutes(self, question: Dict) -> float:
+        """Expected study time for a question: cohort median time to solve if known, else the student's own time_spent"""
+        minutes = None
+        if self.time_stats is not None:
+            minutes = self.time_stats.expected_minutes(question['question_id'])
+        if minutes is None:
+            minutes = (question.get('time_spent') or 0) / 60000
+        return max(minutes, 1 / 60)  # Floor at one second to avoid dividing by zero
+
+    def identify_high_impact_questions(self, student_responses: List[Dict], top_n: int = 5,
+                                       rank_by: str = 'impact') -> Dict[str, List[Dict]]:
+        """Rank missed questions by impact score, or by expected points per minute when rank_by='efficiency'"""
+        if rank_by not in ('impact', 'efficiency'):
+            raise ValueError(f"Unknown rank_by: {rank_by}")
         current_score, current_module2_difficulties = self.calculate_current_score(student_responses)
         incorrect_questions = [r for r in student_responses if not r['correct']]
         question_impacts = []
         for question in incorrect_questions:
-            impact = self.calculate_impact_score(
+            # Re-score once; the complexity bonus only depends on the question itself
+            points_gained = self.calculate_impact_score(
                 student_responses,
                 question['question_id'],
                 current_score,
-                current_module2_difficulties
+                current_module2_difficulties,
+                include_complexity_bonus=False
             )
+            impact = points_gained + self.complexity_bonus(question)
             # Extract subject name and map section to module
             subject = question['subject']['name'] if isinstance(question['subject'], dict) else question['subject']
             module = 1 if question['section'] == 'Static' else 2
             difficulty = question.get('compleixty', 'unknown')  # Handle the typo in the data
             
-            question_impacts.append({
+            question_impact = {
                 'question_id': question['question_id'],
                 'subject': subject,
                 'module': module,
                 'difficulty': difficulty,
                 'impact_score': impact,
                 'is_module1': module == 1
-            })
-        question_impacts.sort(key=lambda x: x['impact_score'], reverse=True)
+            }
+            if rank_by == 'efficiency':
+                # Points per minute uses the raw score gain; time replaces the complexity bonus as the effort signal
+                expected_minutes = self.estimate_minutes(question)
+                question_impact['points_gained'] = points_gained
+                question_impact['expected_minutes'] = round(expected_minutes, 2)
+                question_impact['points_per_minute'] = round(points_gained / expected_minutes, 2)
+            question_impacts.append(question_impact)
+        if rank_by == 'efficiency':
+            question_impacts.sort(key=lambda x: (x['points_per_minute'], x['impact_score']), reverse=True)
+        else:
+            question_impacts.sort(key=lambda x: x['impact_score'], reverse=True)
         results = {}
         for subject in self.subjects:
             subject_questions = [q for q in question_impacts if q['subject'] == subject]
             results[subject] = subject_questions[:top_n]
         return results
 
-    def generate_recommendations(self, student_responses: List[Dict], top_n: int = 5) -> Dict:
+    def generate_recommendations(self, student_responses: List[Dict], top_n: int = 5,
+                                 rank_by: str = 'impact') -> Dict:
         current_score, current_module2_difficulties = self.calculate_current_score(student_responses)
-        high_impact_questions = self.identify_high_impact_questions(student_responses, top_n)
+        high_impact_questions = self.identify_high_impact_questions(student_responses, top_n, rank_by)
         recommendations = {
             'current_total_score': current_score,
             'current_module2_difficulties': current_module2_difficulties,
+            'rank_by': rank_by,
+            'scoring_map': self.resolve_scoring_key(student_responses),
             'recommendations': {},
             'summary': {}
         }